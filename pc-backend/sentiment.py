@@ -1,6 +1,84 @@
+import string
 from datetime import datetime
 from typing import Dict, List
 
+import numpy as np
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    # Optional C extension (see sentiment_fast.pyx for build notes)
+    import sentiment_fast
+except ImportError:
+    sentiment_fast = None
+
+
+def _trend_risk(arr):
+    """Numeric kernel for compute_trend_and_risk (JIT-compiled when numba is available)"""
+    recent_avg = arr[-3:].mean()
+    older_avg = arr[-6:-3].mean()
+
+    if recent_avg > older_avg + 10:
+        trend_code = 1  # worsening
+    elif recent_avg < older_avg - 10:
+        trend_code = 2  # improving
+    else:
+        trend_code = 0  # stable
+
+    if recent_avg >= 60:
+        risk_code = 2  # high
+    elif recent_avg >= 30:
+        risk_code = 1  # medium
+    else:
+        risk_code = 0  # low
+
+    return trend_code, risk_code, recent_avg
+
+
+def _pattern_stats(arr):
+    """Numeric kernel for analyze_pattern (JIT-compiled when numba is available)"""
+    high_negativity_count = 0
+    for score in arr:
+        if score >= 30:
+            high_negativity_count += 1
+
+    escalating = False
+    if arr.size >= 5:
+        recent_avg = arr[-3:].mean()
+        older_avg = arr[:3].mean()
+        escalating = recent_avg > older_avg + 20
+
+    return high_negativity_count, escalating
+
+
+if njit is not None:
+    _trend_risk = njit(cache=True)(_trend_risk)
+    _pattern_stats = njit(cache=True)(_pattern_stats)
+
+_TRENDS = ("stable", "worsening", "improving")
+_RISK_LEVELS = ("low", "medium", "high")
+
+# ASCII-only lowercase table; skips Unicode case-folding, which the
+# keyword lists never need
+_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Integer ids for primary_emotion (0 = none) so emotion histories can be
+# counted as uint8 arrays instead of comparing strings per record
+EMOTIONS = {
+    "loneliness": 1,
+    "sadness": 2,
+    "anxiety": 3,
+    "social_disconnection": 4
+}
+
 class EnhancedSentimentAnalyzer:
     def __init__(self):
         # Expanded keyword categories
@@ -25,26 +103,79 @@ class EnhancedSentimentAnalyzer:
                 "don't care", "ignored", "excluded"
             ]
         }
-    
+
+        # Inverse map so a keyword hit resolves to its emotion with one
+        # dict lookup instead of iterating the categories
+        self._kw_to_emotion = {
+            kw: emotion
+            for emotion, keywords in self.emotion_keywords.items()
+            for kw in keywords
+        }
+
+        # Flat keyword list plus pre-encoded bytes for the fallback
+        # matchers; bytes.find hits CPython's fastsearch without
+        # re-deciding UTF-8 per comparison
+        self._all_keywords = list(self._kw_to_emotion)
+        self._all_kw_bytes = [kw.encode() for kw in self._all_keywords]
+
+        # Deterministic (category, keyword) rank for ordering scan hits;
+        # _all_keywords already follows category-priority order
+        self._kw_rank = {kw: i for i, kw in enumerate(self._all_keywords)}
+
+        # Build a single Aho-Corasick automaton so analyze() scans the
+        # text once instead of doing one substring search per keyword
+        self._automaton = None
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for kw in self._all_keywords:
+                self._automaton.add_word(kw, kw)
+            self._automaton.make_automaton()
+
     def analyze(self, text: str) -> Dict:
         """
         Comprehensive sentiment analysis
         Returns detailed emotion breakdown with confidence scores
         """
-        text_lower = text.lower()
+        text_lower = text.translate(_LOWER)
         
         # Analyze each emotion category
         emotion_scores = {}
         detected_keywords = {}
         
-        for emotion, keywords in self.emotion_keywords.items():
-            matches = [kw for kw in keywords if kw in text_lower]
-            
-            if matches:
-                # Calculate confidence based on number of matches
-                confidence = min(len(matches) * 25, 100)  # Max 100%
-                emotion_scores[emotion] = confidence
-                detected_keywords[emotion] = matches
+        if self._automaton is not None:
+            # Single pass over the text reports every keyword hit
+            hits = set()
+            for _, kw in self._automaton.iter(text_lower):
+                hits.add(kw)
+        elif sentiment_fast is not None:
+            # C extension: memmem-based scan without interpreter dispatch
+            text_bytes = text_lower.encode()
+            hits = [
+                self._all_keywords[i]
+                for i in sentiment_fast.match_keywords(text_bytes, self._all_kw_bytes)
+            ]
+        else:
+            # Fallback: per-keyword scan over the bytes encoded once
+            text_bytes = text_lower.encode()
+            hits = [
+                kw for kw, kwb in zip(self._all_keywords, self._all_kw_bytes)
+                if text_bytes.find(kwb) != -1
+            ]
+
+        # Each hit lands in exactly one category, so the total match
+        # count falls out of the scan without re-walking the dict
+        total_matches = len(hits)
+
+        # Group hits in category-priority order: ties on confidence must
+        # resolve the same way as the original sequential scan (e.g.
+        # loneliness before sadness), not by hash order
+        for kw in sorted(hits, key=self._kw_rank.__getitem__):
+            detected_keywords.setdefault(self._kw_to_emotion[kw], []).append(kw)
+
+        for emotion, matches in detected_keywords.items():
+            # Calculate confidence based on number of matches
+            confidence = min(len(matches) * 25, 100)  # Max 100%
+            emotion_scores[emotion] = confidence
         
         # Determine primary emotion
         primary_emotion = None
@@ -55,7 +186,6 @@ class EnhancedSentimentAnalyzer:
             max_confidence = emotion_scores[primary_emotion]
         
         # Calculate overall negativity score
-        total_matches = sum(len(kw) for kw in detected_keywords.values())
         negativity_score = min(total_matches * 15, 100)
         
         # Determine severity
@@ -71,6 +201,7 @@ class EnhancedSentimentAnalyzer:
         return {
             "timestamp": datetime.now().isoformat(),
             "primary_emotion": primary_emotion,
+            "primary_emotion_id": EMOTIONS.get(primary_emotion, 0),
             "confidence": max_confidence,
             "severity": severity,
             "negativity_score": negativity_score,
@@ -78,45 +209,38 @@ class EnhancedSentimentAnalyzer:
             "detected_keywords": detected_keywords,
             "needs_attention": negativity_score >= 30
         }
-    
-    def compute_trend_and_risk(self, sentiment_history):
+
+    def analyze_batch(self, texts: List[str]) -> List[Dict]:
+        """Analyze a batch of messages (e.g. when replaying history)"""
+        return [self.analyze(t) for t in texts]
+
+    def compute_trend_and_risk(self, sentiment_history, neg_scores=None):
         if len(sentiment_history) < 4:
             return {
                 "trend": "insufficient_data",
                 "risk_level": "low"
             }
 
-        # Recent vs older negativity
-        recent = sentiment_history[-3:]
-        older = sentiment_history[-6:-3]
-
-        recent_avg = sum(s.get("negativity_score", 0) for s in recent) / len(recent)
-        older_avg = sum(s.get("negativity_score", 0) for s in older) / len(older)
-
-        # Determine trend
-        if recent_avg > older_avg + 10:
-            trend = "worsening"
-        elif recent_avg < older_avg - 10:
-            trend = "improving"
-        else:
-            trend = "stable"
+        # Recent vs older negativity, reduced in the JIT kernel
+        if neg_scores is None:
+            neg_scores = np.array(
+                [s.get("negativity_score", 0) for s in sentiment_history[-6:]],
+                dtype=np.float64
+            )
 
-        # Determine risk level
-        if recent_avg >= 60:
-            risk = "high"
-        elif recent_avg >= 30:
-            risk = "medium"
-        else:
-            risk = "low"
+        trend_code, risk_code, recent_avg = _trend_risk(
+            np.asarray(neg_scores, dtype=np.float64)
+        )
 
         return {
-            "trend": trend,
-            "risk_level": risk,
-            "recent_avg_negativity": round(recent_avg, 2)
+            "trend": _TRENDS[trend_code],
+            "risk_level": _RISK_LEVELS[risk_code],
+            "recent_avg_negativity": round(float(recent_avg), 2)
     }
 
     
-    def analyze_pattern(self, sentiment_history: List[Dict]) -> Dict:
+    def analyze_pattern(self, sentiment_history: List[Dict], neg_scores=None,
+                        emotion_ids=None) -> Dict:
         """
         Detect concerning patterns over time
         """
@@ -125,30 +249,34 @@ class EnhancedSentimentAnalyzer:
                 "pattern_detected": False,
                 "reason": "Insufficient data (need 3+ conversations)"
             }
-        
+
         # Get recent sentiments (last 10)
         recent = sentiment_history[-10:]
-        
-        # Count high-negativity instances
-        high_negativity_count = sum(
-            1 for s in recent 
-            if s.get("negativity_score", 0) >= 30
+
+        if neg_scores is None:
+            neg_scores = np.array(
+                [s.get("negativity_score", 0) for s in recent],
+                dtype=np.float64
+            )
+
+        # High-negativity count and escalation, reduced in the JIT kernel
+        high_negativity_count, escalating = _pattern_stats(
+            np.asarray(neg_scores, dtype=np.float64)[-10:]
         )
-        
-        # Count loneliness mentions
-        loneliness_count = sum(
-            1 for s in recent 
-            if s.get("primary_emotion") == "loneliness"
+        high_negativity_count = int(high_negativity_count)
+        escalating = bool(escalating)
+
+        # Count loneliness mentions on the uint8 id array
+        if emotion_ids is None:
+            emotion_ids = np.array(
+                [EMOTIONS.get(s.get("primary_emotion"), 0) for s in recent],
+                dtype=np.uint8
+            )
+
+        loneliness_count = int(
+            (np.asarray(emotion_ids, dtype=np.uint8)[-10:] == EMOTIONS["loneliness"]).sum()
         )
-        
-        # Detect escalation (scores getting worse)
-        if len(recent) >= 5:
-            recent_avg = sum(s.get("negativity_score", 0) for s in recent[-3:]) / 3
-            older_avg = sum(s.get("negativity_score", 0) for s in recent[:3]) / 3
-            escalating = recent_avg > older_avg + 20
-        else:
-            escalating = False
-        
+
         # Trigger alerts
         alert_triggered = False
         alert_reason = []
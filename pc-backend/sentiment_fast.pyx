@@ -0,0 +1,36 @@
+# cython: language_level=3
+# distutils: extra_compile_args=-D_GNU_SOURCE
+"""
+C-speed keyword matcher for EnhancedSentimentAnalyzer.
+
+Optional extension: sentiment.py falls back to pure Python when this
+module is not built. Build in place with:
+
+    cythonize -i sentiment_fast.pyx
+"""
+
+from cpython.bytes cimport PyBytes_AsStringAndSize
+
+cdef extern from "string.h":
+    void *memmem(const void *haystack, size_t haystacklen,
+                 const void *needle, size_t needlelen)
+
+
+def match_keywords(bytes text, list kw_bytes):
+    """Return the indexes of the keywords that occur in text"""
+    cdef char* haystack
+    cdef Py_ssize_t haystack_len
+    cdef char* needle
+    cdef Py_ssize_t needle_len
+    cdef Py_ssize_t i
+    cdef bytes kw
+
+    PyBytes_AsStringAndSize(text, &haystack, &haystack_len)
+
+    hits = []
+    for i in range(len(kw_bytes)):
+        kw = kw_bytes[i]
+        PyBytes_AsStringAndSize(kw, &needle, &needle_len)
+        if memmem(haystack, haystack_len, needle, needle_len) != NULL:
+            hits.append(i)
+    return hits
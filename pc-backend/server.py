@@ -1,17 +1,45 @@
 from sentiment import EnhancedSentimentAnalyzer
 from typing import List, Dict
+import asyncio
 import json
-import subprocess
+import logging
+import logging.handlers
+import queue
+import re
+from collections import deque
 from datetime import datetime
 import os
-import traceback
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import httpx
+import msgspec
+import numpy as np
+import orjson
+
+from fastapi import FastAPI, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 app = FastAPI(title="CompanionMind AI Engine")
 
+# ---------------------------
+# Logging
+# ---------------------------
+# Queue-backed logging so the WebSocket coroutine never blocks on
+# stdout flushes; formatting only happens when the record is emitted
+logger = logging.getLogger("companionmind")
+
+def _setup_logging():
+    log_queue = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, console)
+    listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    return listener
+
+_log_listener = _setup_logging()
+
 # ---------------------------
 # Paths
 # ---------------------------
@@ -60,57 +88,118 @@ conversations = []
 user_profile = {
     "name": "User",
     "loneliness_mentions": 0,
-    "sentiment_scores": []
+    "sentiment_scores": [],
+    # Negativity scores and emotion ids mirrored into flat arrays for
+    # the numeric kernels
+    "neg_scores": np.empty(0, dtype=np.float64),
+    "emotion_ids": np.empty(0, dtype=np.uint8)
 }
 
 # Sensor data storage
+# Histories are bounded deques so appends evict old entries in O(1)
 sensor_data = {
     "motion": {
         "current_activity": "unknown",
         "steps_today": 0,
         "last_movement": None,
-        "fall_alerts": [],
-        "activity_history": []
+        "fall_alerts": deque(maxlen=50),
+        "activity_history": deque(maxlen=100),
+        # Ring buffer of is_active flags mirroring activity_history, so
+        # /stats can take a vectorized mean instead of walking dicts
+        "_is_active_arr": np.zeros(100, dtype=bool),
+        "_is_active_idx": 0
     },
     "location": {
         "is_home": True,
         "left_home_today": False,
         "last_update": None,
-        "history": []
+        "history": deque(maxlen=100)
     },
     "light": {
         "current_level": None,
         "is_dark": False,
         "dark_duration_minutes": 0,
         "last_update": None,
-        "history": []
-    }
+        "history": deque(maxlen=100)
+    },
+    # Bumped on every sensor update so cached risk results can be invalidated
+    "_version": 0
 }
 
 # ===========================
 # AI ENGINE
 # ===========================
+
+# Markers that signal the model started leaking prompt/instructions
+STOP_MARKERS = [
+    '\n---', '\n###', 'Instruction', 'Note:', 'Consider',
+    'Let us', 'System:', 'scenario', 'situation where',
+    'Example:', 'User:', 'Assistant:', 'Human:', 'AI:'
+]
+
+# Sentence boundary for the 2-sentence response limit
+_SENT_SPLIT = re.compile(r'[.!?]+\s*')
+
 class AIEngine:
     def __init__(self):
         self.model = "phi3:mini"
         self.sentiment_analyzer = EnhancedSentimentAnalyzer()
+        # Persistent connection to the local Ollama server keeps the
+        # model warm instead of fork/exec-ing the CLI per turn
+        self._client = httpx.AsyncClient(
+            base_url="http://localhost:11434",
+            timeout=30
+        )
+        # Rolling prompt context; the full conversations list keeps
+        # growing but prompt building only ever needs the last 5 turns
+        self.recent_ctx = deque(maxlen=5)
+        # One compiled pattern instead of a substring scan per marker
+        self._stop_re = re.compile('|'.join(re.escape(m) for m in STOP_MARKERS))
+        self._skip_re = re.compile(r'(?i)instruction|note:|consider|let us|scenario')
+        # Memoized (key, value) pairs; results are pure functions of the
+        # sentiment history and the sensor snapshot, so reuse them until
+        # either changes
+        self._trend_cache = None
+        self._pattern_cache = None
+        self._combined_cache = None
+
+    def _scores_key(self):
+        scores = user_profile["sentiment_scores"]
+        return (len(scores), scores[-1]["timestamp"] if scores else None)
 
     def get_trend_and_risk(self):
+        key = self._scores_key()
+        if self._trend_cache and self._trend_cache[0] == key:
+            return self._trend_cache[1]
+
         if len(user_profile["sentiment_scores"]) < 4:
-            return {
+            result = {
                 "trend": "insufficient_data",
                 "risk_level": "low",
                 "recent_avg_negativity": 0
             }
+        else:
+            result = self.sentiment_analyzer.compute_trend_and_risk(
+                user_profile["sentiment_scores"],
+                user_profile["neg_scores"]
+            )
 
-        return self.sentiment_analyzer.compute_trend_and_risk(
-            user_profile["sentiment_scores"]
-        )
+        self._trend_cache = (key, result)
+        return result
+
+    def get_combined_risk_assessment(self, emotional_risk=None):
+        """Combines emotional sentiment with physical sensor data
+
+        Callers that already computed get_trend_and_risk() can pass the
+        result in to avoid reducing the sentiment history twice.
+        """
+        key = self._scores_key() + (sensor_data["_version"],)
+        if self._combined_cache and self._combined_cache[0] == key:
+            return self._combined_cache[1]
+
+        if emotional_risk is None:
+            emotional_risk = self.get_trend_and_risk()
 
-    def get_combined_risk_assessment(self):
-        """Combines emotional sentiment with physical sensor data"""
-        emotional_risk = self.get_trend_and_risk()
-        
         risk_factors = []
         risk_score = 0
         
@@ -147,13 +236,16 @@ class AIEngine:
         else:
             overall_risk = "low"
         
-        return {
+        result = {
             "overall_risk_level": overall_risk,
             "risk_score": total_risk_score,
             "emotional_component": emotional_risk,
             "physical_risk_factors": risk_factors,
             "recommendation": self._get_risk_recommendation(overall_risk, risk_factors)
         }
+
+        self._combined_cache = (key, result)
+        return result
     
     def _get_risk_recommendation(self, risk_level, factors):
         if risk_level == "critical":
@@ -165,12 +257,12 @@ class AIEngine:
         else:
             return "ROUTINE MONITORING: User appears stable."
 
-    def generate_response(self, user_message: str, history: list) -> str:
+    async def generate_response(self, user_message: str) -> str:
         """Generate AI response with aggressive cleaning"""
-        
+
         context = "\n".join([
             f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
-            for msg in history[-5:]
+            for msg in self.recent_ctx
         ])
 
         # SIMPLIFIED PROMPT - less likely to leak
@@ -183,49 +275,39 @@ User: {user_message}
 Assistant:"""
 
         try:
-            result = subprocess.run(
-                ["ollama", "run", self.model, prompt],
-                capture_output=True,
-                text=True,
-                timeout=30
+            resp = await self._client.post(
+                "/api/generate",
+                json={"model": self.model, "prompt": prompt, "stream": False}
             )
+            resp.raise_for_status()
 
-            response = result.stdout.strip()
+            response = resp.json().get("response", "").strip()
 
             if not response:
                 return "I'm here with you. Tell me more."
 
             # AGGRESSIVE CLEANING
-            # Remove everything after certain markers
-            stop_markers = [
-                '\n---', '\n###', 'Instruction', 'Note:', 'Consider',
-                'Let us', 'System:', 'scenario', 'situation where',
-                'Example:', 'User:', 'Assistant:', 'Human:', 'AI:'
-            ]
-            
-            for marker in stop_markers:
-                if marker in response:
-                    response = response.split(marker)[0].strip()
-            
+            # Cut everything after the first stop marker in one regex pass
+            response = self._stop_re.split(response, 1)[0].strip()
+
             # Split into lines and only keep actual response
             lines = response.split('\n')
             clean_lines = []
-            
+
             for line in lines:
                 line = line.strip()
                 # Skip empty lines
                 if not line:
                     continue
                 # Stop at instruction-like text
-                if any(word in line.lower() for word in ['instruction', 'note:', 'consider', 'let us', 'scenario']):
+                if self._skip_re.search(line):
                     break
                 clean_lines.append(line)
             
             response = ' '.join(clean_lines).strip()
             
             # Limit to 2 sentences
-            sentences = response.replace('!', '.').replace('?', '.').split('.')
-            sentences = [s.strip() for s in sentences if s.strip()]
+            sentences = [s.strip() for s in _SENT_SPLIT.split(response) if s.strip()]
             
             if len(sentences) > 2:
                 response = '. '.join(sentences[:2]) + '.'
@@ -237,14 +319,22 @@ Assistant:"""
             return response if response else "I'm here listening."
 
         except Exception as e:
-            print(f"❌ AI Error: {e}")
+            logger.error("❌ AI Error: %s", e)
             return "I'm here with you."
 
     def analyze_sentiment(self, text: str) -> dict:
         return self.sentiment_analyzer.analyze(text)
 
     def analyze_patterns(self, scores: List[Dict]) -> Dict:
-        return self.sentiment_analyzer.analyze_pattern(scores)
+        key = (len(scores), scores[-1]["timestamp"] if scores else None)
+        if self._pattern_cache and self._pattern_cache[0] == key:
+            return self._pattern_cache[1]
+
+        result = self.sentiment_analyzer.analyze_pattern(
+            scores, user_profile["neg_scores"], user_profile["emotion_ids"]
+        )
+        self._pattern_cache = (key, result)
+        return result
 
 
 ai_engine = AIEngine()
@@ -267,13 +357,16 @@ def handle_motion_update(data):
     }
     
     sensor_data["motion"]["activity_history"].append(activity_snapshot)
-    
-    if len(sensor_data["motion"]["activity_history"]) > 100:
-        sensor_data["motion"]["activity_history"].pop(0)
-    
-    print(f"🏃 Motion Update: {sensor_data['motion']['current_activity']} | "
-          f"Steps: {data.get('steps', 0)} | "
-          f"Movements: {data.get('movementCount')}")
+
+    idx = sensor_data["motion"]["_is_active_idx"]
+    sensor_data["motion"]["_is_active_arr"][idx % 100] = bool(data.get("isActive"))
+    sensor_data["motion"]["_is_active_idx"] = idx + 1
+
+    sensor_data["_version"] += 1
+
+    logger.info("🏃 Motion Update: %s | Steps: %s | Movements: %s",
+                sensor_data["motion"]["current_activity"],
+                data.get("steps", 0), data.get("movementCount"))
 
 def handle_fall_alert(data):
     """Handle fall detection alert from phone"""
@@ -284,16 +377,13 @@ def handle_fall_alert(data):
     }
     
     sensor_data["motion"]["fall_alerts"].append(fall_event)
-    
-    if len(sensor_data["motion"]["fall_alerts"]) > 50:
-        sensor_data["motion"]["fall_alerts"].pop(0)
-    
-    print(f"\n{'='*60}")
-    print(f"🚨 FALL ALERT DETECTED!")
-    print(f"   Magnitude: {data.get('magnitude')} m/s²")
-    print(f"   Time: {fall_event['time']}")
-    print(f"   CAREGIVER NOTIFICATION TRIGGERED")
-    print(f"{'='*60}\n")
+    sensor_data["_version"] += 1
+
+    logger.warning(
+        "\n%s\n🚨 FALL ALERT DETECTED!\n   Magnitude: %s m/s²\n"
+        "   Time: %s\n   CAREGIVER NOTIFICATION TRIGGERED\n%s\n",
+        "=" * 60, data.get("magnitude"), fall_event["time"], "=" * 60
+    )
 
 def handle_location_update(data):
     """Process GPS location data from phone"""
@@ -308,14 +398,11 @@ def handle_location_update(data):
     }
     
     sensor_data["location"]["history"].append(location_snapshot)
-    
-    if len(sensor_data["location"]["history"]) > 100:
-        sensor_data["location"]["history"].pop(0)
-    
+    sensor_data["_version"] += 1
+
     status = "at home" if data.get("isHome") else "away from home"
-    print(f"📍 Location Update: {status} | "
-          f"Distance: {data.get('distance', 0)}m | "
-          f"Left home today: {data.get('leftHomeToday')}")
+    logger.info("📍 Location Update: %s | Distance: %sm | Left home today: %s",
+                status, data.get("distance", 0), data.get("leftHomeToday"))
 
 def handle_light_update(data):
     """Process ambient light sensor data from phone"""
@@ -331,16 +418,22 @@ def handle_light_update(data):
     }
     
     if "history" not in sensor_data["light"]:
-        sensor_data["light"]["history"] = []
-    
+        sensor_data["light"]["history"] = deque(maxlen=100)
+
     sensor_data["light"]["history"].append(light_snapshot)
-    
-    if len(sensor_data["light"]["history"]) > 100:
-        sensor_data["light"]["history"].pop(0)
-    
+    sensor_data["_version"] += 1
+
     dark_status = "DARK" if data.get("isDark") else "bright"
-    print(f"💡 Light Update: {data.get('currentLevel')} lux ({dark_status}) | "
-          f"Dark duration: {data.get('darkDuration')} min")
+    logger.info("💡 Light Update: %s lux (%s) | Dark duration: %s min",
+                data.get("currentLevel"), dark_status, data.get("darkDuration"))
+
+# O(1) dispatch for sensor messages instead of an if/elif ladder
+SENSOR_HANDLERS = {
+    "motion_update": handle_motion_update,
+    "fall_alert": handle_fall_alert,
+    "location_update": handle_location_update,
+    "light_update": handle_light_update
+}
 
 # ===========================
 # ROOT
@@ -362,28 +455,48 @@ async def home():
 # ===========================
 # STATS (Dashboard)
 # ===========================
+
+# Serialized /stats bytes, reused while neither the conversation nor
+# the sensor snapshot has changed (dashboards poll this endpoint)
+_stats_cache = (None, None)
+
 @app.get("/stats")
 async def get_stats():
+    global _stats_cache
+
+    key = (
+        len(conversations),
+        ai_engine._scores_key(),
+        sensor_data["_version"]
+    )
+    if _stats_cache[0] == key:
+        return Response(content=_stats_cache[1], media_type="application/json")
 
     recent = user_profile["sentiment_scores"][-10:]
     avg_negativity = 0
 
-    if recent:
-        avg_negativity = sum(s.get("negativity_score", 0) for s in recent) / len(recent)
+    neg_scores = user_profile["neg_scores"]
+    if neg_scores.size:
+        avg_negativity = float(neg_scores[-10:].mean())
 
     pattern_analysis = {}
     if len(user_profile["sentiment_scores"]) >= 3:
         pattern_analysis = ai_engine.analyze_patterns(user_profile["sentiment_scores"])
 
     trend_info = ai_engine.get_trend_and_risk()
-    combined_risk = ai_engine.get_combined_risk_assessment()
-    
-    # Calculate activity percentage
-    recent_activity = sensor_data["motion"]["activity_history"][-20:]
-    active_count = sum(1 for a in recent_activity if a.get("is_active"))
-    activity_percentage = (active_count / len(recent_activity) * 100) if recent_activity else 0
-
-    return {
+    combined_risk = ai_engine.get_combined_risk_assessment(trend_info)
+
+    # Calculate activity percentage over the last 20 samples in the ring
+    # buffer (order does not matter for the mean)
+    recent_activity = list(sensor_data["motion"]["activity_history"])[-20:]
+    idx = sensor_data["motion"]["_is_active_idx"]
+    window = min(20, idx, 100)
+    activity_percentage = 0
+    if window:
+        positions = np.arange(idx - window, idx) % 100
+        activity_percentage = float(sensor_data["motion"]["_is_active_arr"][positions].mean()) * 100
+
+    payload = {
         "total_conversations": len(conversations) // 2,
         "loneliness_mentions": user_profile["loneliness_mentions"],
         "average_negativity": round(avg_negativity, 2),
@@ -399,14 +512,14 @@ async def get_stats():
                 "steps_today": sensor_data["motion"]["steps_today"],
                 "activity_percentage": round(activity_percentage, 1),
                 "last_movement": sensor_data["motion"]["last_movement"],
-                "fall_alerts": sensor_data["motion"]["fall_alerts"][-10:],
+                "fall_alerts": list(sensor_data["motion"]["fall_alerts"])[-10:],
                 "recent_activity": recent_activity
             },
             "location": {
                 "is_home": sensor_data["location"]["is_home"],
                 "left_home_today": sensor_data["location"]["left_home_today"],
                 "last_update": sensor_data["location"]["last_update"],
-                "recent_history": sensor_data["location"]["history"][-10:]
+                "recent_history": list(sensor_data["location"]["history"])[-10:]
             },
             "light": {
                 "current_level": sensor_data["light"]["current_level"],
@@ -420,15 +533,33 @@ async def get_stats():
         "combined_risk": combined_risk
     }
 
+    body = orjson.dumps(payload)
+    _stats_cache = (key, body)
+    return Response(content=body, media_type="application/json")
+
 # ===========================
 # WEBSOCKET (Phone)
 # ===========================
+
+# Fixed response shape encoded by msgspec's schema-driven serializer
+# instead of rebuilding and json.dumps-ing a nested dict per turn
+class ResponseMetadata(msgspec.Struct):
+    sentiment: dict
+    pattern_alert: dict
+    trend: dict
+    combined_risk: dict
+    timestamp: str
+
+class ResponseEnvelope(msgspec.Struct):
+    type: str
+    content: str
+    metadata: ResponseMetadata
+
+_envelope_encoder = msgspec.json.Encoder()
 @app.websocket("/ws/client")
 async def websocket_client(websocket: WebSocket):
     await websocket.accept()
-    print("\n" + "="*60)
-    print("✓ Phone connected to WebSocket!")
-    print("="*60)
+    logger.info("\n%s\n✓ Phone connected to WebSocket!\n%s", "=" * 60, "=" * 60)
 
     try:
         while True:
@@ -438,26 +569,17 @@ async def websocket_client(websocket: WebSocket):
             # ===========================
             # SENSOR MESSAGE HANDLERS
             # ===========================
-            if msg_type == "motion_update":
-                handle_motion_update(data)
+            handler = SENSOR_HANDLERS.get(msg_type)
+            if handler:
+                handler(data)
+
+                if msg_type == "fall_alert":
+                    await websocket.send_json({
+                        "type": "fall_alert_received",
+                        "message": "Fall alert received and logged."
+                    })
                 continue
-                
-            elif msg_type == "fall_alert":
-                handle_fall_alert(data)
-                await websocket.send_json({
-                    "type": "fall_alert_received",
-                    "message": "Fall alert received and logged."
-                })
-                continue
-                
-            elif msg_type == "location_update":
-                handle_location_update(data)
-                continue
-                
-            elif msg_type == "light_update":
-                handle_light_update(data)
-                continue
-            
+
             # ===========================
             # REGULAR CONVERSATION
             # ===========================
@@ -466,65 +588,80 @@ async def websocket_client(websocket: WebSocket):
             if not user_message:
                 continue
 
-            print(f"\n📱 User: {user_message}")
+            logger.info("\n📱 User: %s", user_message)
 
             conversations.append({
                 "role": "user",
                 "content": user_message,
                 "timestamp": datetime.now().isoformat()
             })
+            ai_engine.recent_ctx.append({"role": "user", "content": user_message})
 
-            # Sentiment analysis
-            sentiment = ai_engine.analyze_sentiment(user_message)
+            # Sentiment analysis off the event-loop thread so other
+            # connections are not blocked on the CPU work
+            sentiment = await asyncio.to_thread(
+                ai_engine.analyze_sentiment, user_message
+            )
             user_profile["sentiment_scores"].append(sentiment)
+            user_profile["neg_scores"] = np.append(
+                user_profile["neg_scores"],
+                np.float64(sentiment["negativity_score"])
+            )
+            user_profile["emotion_ids"] = np.append(
+                user_profile["emotion_ids"],
+                np.uint8(sentiment["primary_emotion_id"])
+            )
 
             if sentiment.get("primary_emotion"):
-                print(f"⚠️  Emotion: {sentiment['primary_emotion']} ({sentiment['confidence']}%)")
-                print(f"   Severity: {sentiment['severity']} | Negativity: {sentiment['negativity_score']}/100")
+                logger.info("⚠️  Emotion: %s (%s%%)\n   Severity: %s | Negativity: %s/100",
+                            sentiment["primary_emotion"], sentiment["confidence"],
+                            sentiment["severity"], sentiment["negativity_score"])
 
             if sentiment.get("primary_emotion") == "loneliness":
                 user_profile["loneliness_mentions"] += 1
-                print(f"🚨 Loneliness mention count: {user_profile['loneliness_mentions']}")
+                logger.info("🚨 Loneliness mention count: %s",
+                            user_profile["loneliness_mentions"])
 
             pattern_analysis = ai_engine.analyze_patterns(user_profile["sentiment_scores"])
 
             if pattern_analysis.get("pattern_detected"):
-                print(f"\n🚨 PATTERN ALERT!")
-                print(f"   Severity: {pattern_analysis.get('severity')}")
-                print(f"   Reasons: {', '.join(pattern_analysis.get('reasons', []))}")
+                logger.warning("\n🚨 PATTERN ALERT!\n   Severity: %s\n   Reasons: %s",
+                               pattern_analysis.get("severity"),
+                               ", ".join(pattern_analysis.get("reasons", [])))
 
             # AI response
-            ai_response = ai_engine.generate_response(user_message, conversations)
+            ai_response = await ai_engine.generate_response(user_message)
 
             conversations.append({
                 "role": "assistant",
                 "content": ai_response,
                 "timestamp": datetime.now().isoformat()
             })
+            ai_engine.recent_ctx.append({"role": "assistant", "content": ai_response})
 
-            print(f"🤖 AI: {ai_response}")
-            print("="*60 + "\n")
+            logger.info("🤖 AI: %s\n%s\n", ai_response, "=" * 60)
 
             trend_info = ai_engine.get_trend_and_risk()
-            combined_risk = ai_engine.get_combined_risk_assessment()
-
-            await websocket.send_json({
-                "type": "response",
-                "content": ai_response,
-                "metadata": {
-                    "sentiment": sentiment,
-                    "pattern_alert": pattern_analysis,
-                    "trend": trend_info,
-                    "combined_risk": combined_risk,
-                    "timestamp": datetime.now().isoformat()
-                }
-            })
+            combined_risk = ai_engine.get_combined_risk_assessment(trend_info)
+
+            envelope = ResponseEnvelope(
+                type="response",
+                content=ai_response,
+                metadata=ResponseMetadata(
+                    sentiment=sentiment,
+                    pattern_alert=pattern_analysis,
+                    trend=trend_info,
+                    combined_risk=combined_risk,
+                    timestamp=datetime.now().isoformat()
+                )
+            )
+            # Text frame: the phone client JSON.parses event.data
+            await websocket.send_text(_envelope_encoder.encode(envelope).decode())
 
     except WebSocketDisconnect:
-        print("\n📱 Phone disconnected from WebSocket")
+        logger.info("\n📱 Phone disconnected from WebSocket")
     except Exception as e:
-        print(f"\n❌ WebSocket Error: {e}")
-        traceback.print_exc()
+        logger.exception("\n❌ WebSocket Error: %s", e)
 
 # ===========================
 # RUN